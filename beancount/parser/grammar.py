@@ -5,12 +5,14 @@ __license__ = "GNU GPLv2"
 
 import collections
 import copy
+import functools
 import re
 import sys
 import traceback
 from os import path
 from datetime import date
 from decimal import Decimal
+from typing import Any, NamedTuple, Set
 
 from beancount.core.number import ZERO
 from beancount.core.number import MISSING
@@ -51,29 +53,43 @@ DeprecatedError = collections.namedtuple('DeprecatedError', 'source message entr
 # Attributes:
 #  key: A string, the name of the key.
 #  value: Any object.
-KeyValue = collections.namedtuple('KeyValue', 'key value')
+KeyValue = NamedTuple('KeyValue', [
+    ('key', str),
+    ('value', Any)])
 
 # Value-type pairs. This is used to represent custom values where the concrete
 # datatypes aren't matching those which are found in the parser.
 #
 # Attributes:
 #  value: Any object.
-#  dtype: The datatype of the object.
-ValueType = collections.namedtuple('ValueType', 'value dtype')
+#  dtype: The datatype of the object, or the account.TYPE sentinel string for
+#    account values.
+ValueType = NamedTuple('ValueType', [
+    ('value', Any),
+    ('dtype', Any)])
 
 # Convenience holding class for amounts with per-share and total value.
 #
 # Attributes:
-#   number_per: A Decimal instance, the cost/price per unit.
-#   number_total: A Decimal instance, the total cost/price.
-#   currency: A string, the commodity of the amount.
-CompoundAmount = collections.namedtuple('CompoundAmount',
-                                        'number_per number_total currency')
+#   number_per: A Decimal instance, the cost/price per unit, or MISSING.
+#   number_total: A Decimal instance, the total cost/price, or None or MISSING.
+#   currency: A string, the commodity of the amount, or MISSING.
+CompoundAmount = NamedTuple('CompoundAmount', [
+    ('number_per', Any),
+    ('number_total', Any),
+    ('currency', Any)])
 
 
 # A unique token used to indicate a merge of the lots of an inventory.
 MERGE_COST = '***'
 
+# The (lowercased) string values which set a boolean option to True.
+TRUE_OPTION_VALUES = frozenset({'true', 'on', '1'})
+
+# A table of single-character strings, indexed by the integer flag values passed
+# in from the parser. This avoids a call to chr() for every posting and transaction.
+FLAG_CHARS = tuple(chr(i) for i in range(256))
+
 
 def valid_account_regexp(options):
     """Build a regexp to validate account names from the options.
@@ -83,18 +99,32 @@ def valid_account_regexp(options):
     Returns:
       A string, a regular expression that will match all account names.
     """
-    names = map(options.__getitem__, ('name_assets',
-                                      'name_liabilities',
-                                      'name_equity',
-                                      'name_income',
-                                      'name_expenses'))
+    names = tuple(map(options.__getitem__, ('name_assets',
+                                            'name_liabilities',
+                                            'name_equity',
+                                            'name_income',
+                                            'name_expenses')))
+    return _compile_account_regexp(names, account.sep, account.ACC_COMP_NAME_RE)
+
 
+@functools.lru_cache(maxsize=32)
+def _compile_account_regexp(names, sep, comp_name_re):
+    """Compile the account regexp for a given set of root account names.
+
+    This is cached because the regexp is rebuilt for every new builder and every
+    time one of the 'name_*' options is set.
+
+    Args:
+      names: A tuple of the five root account type names.
+      sep: A string, the account component separator.
+      comp_name_re: A string, the regular expression for non-root components.
+    Returns:
+      A compiled regular expression object.
+    """
     # Replace the first term of the account regular expression with the specific
     # names allowed under the options configuration. This code is kept in sync
     # with {5672c7270e1e}.
-    return re.compile("(?:{})(?:{}{})+".format('|'.join(names),
-                                               account.sep,
-                                               account.ACC_COMP_NAME_RE))
+    return re.compile("(?:{})(?:{}{})+".format('|'.join(names), sep, comp_name_re))
 
 
 # A temporary data structure used during parsing to hold and accumulate the
@@ -105,13 +135,22 @@ def valid_account_regexp(options):
 # Attributes:
 #  tags: a set object  of the tags to be applied to this transaction.
 #  links: a set of link strings to be applied to this transaction.
-TagsLinks = collections.namedtuple('TagsLinks', 'tags links')
+TagsLinks = NamedTuple('TagsLinks', [
+    ('tags', Set[str]),
+    ('links', Set[str])])
 
 
 class Builder(lexer.LexBuilder):
     """A builder used by the lexer and grammar parser as callbacks to create
     the data objects corresponding to rules parsed from the input file."""
 
+    # Declare the instance attributes up-front; the parser invokes the builder's
+    # methods for every reduced rule and slot access is cheaper than going
+    # through the instance dict.
+    __slots__ = ('tags', 'meta', 'entries', 'options', 'accounts', 'frozensets',
+                 'document_dirs', 'account_regexp', 'dcontext',
+                 'display_context_update')
+
     # pylint: disable=too-many-instance-attributes
     def __init__(self):
         lexer.LexBuilder.__init__(self)
@@ -131,6 +170,13 @@ class Builder(lexer.LexBuilder):
         # A mapping of all the accounts created.
         self.accounts = {}
 
+        # A mapping of all the distinct frozen sets of tags and links created.
+        self.frozensets = {}
+
+        # A mapping of input filename to its absolute directory, used to resolve
+        # relative document filenames.
+        self.document_dirs = {}
+
         # Make the account regexp more restrictive than the default: check
         # types. Warning: This overrides the value in the base class.
         self.account_regexp = valid_account_regexp(self.options)
@@ -139,11 +185,6 @@ class Builder(lexer.LexBuilder):
         self.dcontext = display_context.DisplayContext()
         self.display_context_update = self.dcontext.update
 
-    def _dcupdate(self, number, currency):
-        """Update the display context."""
-        if isinstance(number, Decimal) and currency and currency is not MISSING:
-            self.display_context_update(number, currency)
-
     def finalize(self):
         """Finalize the parser, check for final errors and return the triple.
 
@@ -176,10 +217,14 @@ class Builder(lexer.LexBuilder):
     def get_entries(self):
         """Return the accumulated entries.
 
+        The list of entries is sorted in-place, to avoid holding a second copy of
+        it for large inputs.
+
         Returns:
           A list of sorted directives.
         """
-        return sorted(self.entries, key=data.entry_sortkey)
+        self.entries.sort(key=data.entry_sortkey)
+        return self.entries
 
     def get_options(self):
         """Return the final options map.
@@ -202,8 +247,9 @@ class Builder(lexer.LexBuilder):
         Args:
           entries: A list of entries to store.
         """
-        if entries:
-            self.entries = entries
+        # Note: The parser provides None if there were no entries. The list is
+        # adopted as-is and later sorted in place by get_entries().
+        self.entries = entries or []
         # Also record the name of the processed file.
         self.options['filename'] = filename
 
@@ -267,7 +313,7 @@ class Builder(lexer.LexBuilder):
         Args:
           tag: A string, a tag to be added.
         """
-        self.tags.append(tag)
+        self.tags.append(sys.intern(tag))
 
     def poptag(self, filename, lineno, tag):
         """Pop a tag off the current set of stacks.
@@ -320,7 +366,11 @@ class Builder(lexer.LexBuilder):
           key: option's key (str)
           value: option's value
         """
-        if key not in self.options:
+        # Intern the key; it is compared against and stored in various dicts.
+        key = sys.intern(key)
+        all_options = options.OPTIONS
+        option_descriptor = all_options.get(key)
+        if option_descriptor is None:
             meta = new_metadata(filename, lineno)
             self.errors.append(
                 ParserError(meta, "Invalid option: '{}'".format(key), None))
@@ -331,8 +381,6 @@ class Builder(lexer.LexBuilder):
                 ParserError(meta, "Option '{}' may not be set".format(key), None))
 
         else:
-            option_descriptor = options.OPTIONS[key]
-
             # Issue a warning if the option is deprecated.
             if option_descriptor.deprecated:
                 assert isinstance(option_descriptor.deprecated, str), "Internal error."
@@ -343,7 +391,7 @@ class Builder(lexer.LexBuilder):
             # Rename the option if it has an alias.
             if option_descriptor.alias:
                 key = option_descriptor.alias
-                option_descriptor = options.OPTIONS[key]
+                option_descriptor = all_options[key]
 
             # Convert the value, if necessary.
             if option_descriptor.converter:
@@ -357,40 +405,60 @@ class Builder(lexer.LexBuilder):
                                     None))
                     return
 
-            option = self.options[key]
-            if isinstance(option, list):
-                # Append to a list of values.
-                option.append(value)
-
-            elif isinstance(option, dict):
-                # Set to a dict of values.
-                if not (isinstance(value, tuple) and len(value) == 2):
-                    self.errors.append(
-                        ParserError(
-                            meta, "Error for option '{}': {}".format(key, value), None))
-                    return
-                dict_key, dict_value = value
-                option[dict_key] = dict_value
-
-            elif isinstance(option, bool):
-                # Convert to a boolean.
-                if not isinstance(value, bool):
-                    value = (value.lower() in {'true', 'on'}) or (value == '1')
-                self.options[key] = value
-
-            else:
-                # Set the value.
-                self.options[key] = value
+            # Set the value, using the setter for the type of this option.
+            builder_options = self.options
+            option = builder_options[key]
+            if not OPTION_SETTERS[key](self, filename, lineno, key, value, option):
+                return
 
             # Refresh the list of valid account regexps as we go along.
             if key.startswith('name_'):
-                # Update the set of valid account types.
-                self.account_regexp = valid_account_regexp(self.options)
+                # Update the set of valid account types, if they have changed.
+                if value != option:
+                    self.account_regexp = valid_account_regexp(builder_options)
             elif key == 'insert_pythonpath':
                 # Insert the PYTHONPATH to this file when and only if you
                 # encounter this option.
                 sys.path.insert(0, path.dirname(filename))
 
+    def _set_list_option(self, filename, lineno, key, value, option):
+        """Append a value to a list option. See _set_scalar_option()."""
+        option.append(value)
+        return True
+
+    def _set_dict_option(self, filename, lineno, key, value, option):
+        """Set a (key, value) pair on a dict option. See _set_scalar_option()."""
+        if not (isinstance(value, tuple) and len(value) == 2):
+            meta = new_metadata(filename, lineno)
+            self.errors.append(
+                ParserError(meta, "Error for option '{}': {}".format(key, value), None))
+            return False
+        dict_key, dict_value = value
+        option[dict_key] = dict_value
+        return True
+
+    def _set_bool_option(self, filename, lineno, key, value, option):
+        """Convert and set a boolean option. See _set_scalar_option()."""
+        if not isinstance(value, bool):
+            value = value.lower() in TRUE_OPTION_VALUES
+        self.options[key] = value
+        return True
+
+    def _set_scalar_option(self, filename, lineno, key, value, option):
+        """Set the value of an option.
+
+        Args:
+          filename: current filename.
+          lineno: current line number.
+          key: option's key (str), with its alias resolved.
+          value: option's converted value.
+          option: option's current value.
+        Returns:
+          A boolean, true if the option was set, false if an error was issued.
+        """
+        self.options[key] = value
+        return True
+
     def include(self, filename, lineno, include_filename):
         """Process an include directive.
 
@@ -424,7 +492,10 @@ class Builder(lexer.LexBuilder):
         """
         # Update the mapping that stores the parsed precisions.
         # Note: This is relatively slow, adds about 70ms because of number.as_tuple().
-        self._dcupdate(number, currency)
+        # The number may be MISSING or None, and the currency MISSING or None, for
+        # incomplete amounts.
+        if isinstance(number, Decimal) and currency and currency is not MISSING:
+            self.display_context_update(number, currency)
         return Amount(number, currency)
 
     def compound_amount(self, filename, lineno, number_per, number_total, currency):
@@ -440,8 +511,11 @@ class Builder(lexer.LexBuilder):
         """
         # Update the mapping that stores the parsed precisions.
         # Note: This is relatively slow, adds about 70ms because of number.as_tuple().
-        self._dcupdate(number_per, currency)
-        self._dcupdate(number_total, currency)
+        if currency and currency is not MISSING:
+            if isinstance(number_per, Decimal):
+                self.display_context_update(number_per, currency)
+            if isinstance(number_total, Decimal):
+                self.display_context_update(number_total, currency)
 
         # Note that we are not able to reduce the value to a number per-share
         # here because we only get the number of units in the full lot spec.
@@ -553,7 +627,12 @@ class Builder(lexer.LexBuilder):
             object_list.append(new_object)
         return object_list
 
-    def open(self, filename, lineno, date, account, currencies, booking_str, kvlist):
+    # Note: The directive callbacks below bind the globals they use as default
+    # arguments, so that they are resolved as fast locals. The parser never
+    # provides those arguments.
+
+    def open(self, filename, lineno, date, account, currencies, booking_str, kvlist,
+             _new_metadata=new_metadata, _Open=Open, _Booking=Booking):
         """Process an open directive.
 
         Args:
@@ -567,12 +646,12 @@ class Builder(lexer.LexBuilder):
         Returns:
           A new Open object.
         """
-        meta = new_metadata(filename, lineno, kvlist)
+        meta = _new_metadata(filename, lineno, kvlist)
         error = False
         if booking_str:
             try:
                 # Note: Somehow the 'in' membership operator is not defined on Enum.
-                booking = Booking[booking_str]
+                booking = _Booking[booking_str]
             except KeyError:
                 # If the per-account method is invalid, set it to the global
                 # default method and continue.
@@ -581,14 +660,15 @@ class Builder(lexer.LexBuilder):
         else:
             booking = None
 
-        entry = Open(meta, date, account, currencies, booking)
+        entry = _Open(meta, date, account, currencies, booking)
         if error:
             self.errors.append(ParserError(meta,
                                            "Invalid booking method: {}".format(booking_str),
                                            entry))
         return entry
 
-    def close(self, filename, lineno, date, account, kvlist):
+    def close(self, filename, lineno, date, account, kvlist,
+              _new_metadata=new_metadata, _Close=Close):
         """Process a close directive.
 
         Args:
@@ -600,10 +680,11 @@ class Builder(lexer.LexBuilder):
         Returns:
           A new Close object.
         """
-        meta = new_metadata(filename, lineno, kvlist)
-        return Close(meta, date, account)
+        meta = _new_metadata(filename, lineno, kvlist)
+        return _Close(meta, date, account)
 
-    def commodity(self, filename, lineno, date, currency, kvlist):
+    def commodity(self, filename, lineno, date, currency, kvlist,
+                  _new_metadata=new_metadata, _Commodity=Commodity):
         """Process a close directive.
 
         Args:
@@ -615,10 +696,11 @@ class Builder(lexer.LexBuilder):
         Returns:
           A new Close object.
         """
-        meta = new_metadata(filename, lineno, kvlist)
-        return Commodity(meta, date, currency)
+        meta = _new_metadata(filename, lineno, kvlist)
+        return _Commodity(meta, date, currency)
 
-    def pad(self, filename, lineno, date, account, source_account, kvlist):
+    def pad(self, filename, lineno, date, account, source_account, kvlist,
+            _new_metadata=new_metadata, _Pad=Pad):
         """Process a pad directive.
 
         Args:
@@ -631,10 +713,11 @@ class Builder(lexer.LexBuilder):
         Returns:
           A new Pad object.
         """
-        meta = new_metadata(filename, lineno, kvlist)
-        return Pad(meta, date, account, source_account)
+        meta = _new_metadata(filename, lineno, kvlist)
+        return _Pad(meta, date, account, source_account)
 
-    def balance(self, filename, lineno, date, account, amount, tolerance, kvlist):
+    def balance(self, filename, lineno, date, account, amount, tolerance, kvlist,
+                _new_metadata=new_metadata, _Balance=Balance):
         """Process an assertion directive.
 
         We produce no errors here by default. We replace the failing ones in the
@@ -653,10 +736,11 @@ class Builder(lexer.LexBuilder):
           A new Balance object.
         """
         diff_amount = None
-        meta = new_metadata(filename, lineno, kvlist)
-        return Balance(meta, date, account, amount, tolerance, diff_amount)
+        meta = _new_metadata(filename, lineno, kvlist)
+        return _Balance(meta, date, account, amount, tolerance, diff_amount)
 
-    def event(self, filename, lineno, date, event_type, description, kvlist):
+    def event(self, filename, lineno, date, event_type, description, kvlist,
+              _new_metadata=new_metadata, _Event=Event):
         """Process an event directive.
 
         Args:
@@ -669,10 +753,11 @@ class Builder(lexer.LexBuilder):
         Returns:
           A new Event object.
         """
-        meta = new_metadata(filename, lineno, kvlist)
-        return Event(meta, date, event_type, description)
+        meta = _new_metadata(filename, lineno, kvlist)
+        return _Event(meta, date, event_type, description)
 
-    def query(self, filename, lineno, date, query_name, query_string, kvlist):
+    def query(self, filename, lineno, date, query_name, query_string, kvlist,
+              _new_metadata=new_metadata, _Query=Query):
         """Process a document directive.
 
         Args:
@@ -685,10 +770,11 @@ class Builder(lexer.LexBuilder):
         Returns:
           A new Query object.
         """
-        meta = new_metadata(filename, lineno, kvlist)
-        return Query(meta, date, query_name, query_string)
+        meta = _new_metadata(filename, lineno, kvlist)
+        return _Query(meta, date, query_name, query_string)
 
-    def price(self, filename, lineno, date, currency, amount, kvlist):
+    def price(self, filename, lineno, date, currency, amount, kvlist,
+              _new_metadata=new_metadata, _Price=Price):
         """Process a price directive.
 
         Args:
@@ -701,10 +787,11 @@ class Builder(lexer.LexBuilder):
         Returns:
           A new Price object.
         """
-        meta = new_metadata(filename, lineno, kvlist)
-        return Price(meta, date, currency, amount)
+        meta = _new_metadata(filename, lineno, kvlist)
+        return _Price(meta, date, currency, amount)
 
-    def note(self, filename, lineno, date, account, comment, tags_links, kvlist):
+    def note(self, filename, lineno, date, account, comment, tags_links, kvlist,
+             _new_metadata=new_metadata, _Note=Note):
         """Process a note directive.
 
         Args:
@@ -717,12 +804,12 @@ class Builder(lexer.LexBuilder):
         Returns:
           A new Note object.
         """
-        meta = new_metadata(filename, lineno, kvlist)
+        meta = _new_metadata(filename, lineno, kvlist)
         tags, links = self._finalize_tags_links(tags_links.tags, tags_links.links)
-        return Note(meta, date, account, comment, tags, links)
+        return _Note(meta, date, account, comment, tags, links)
 
     def document(self, filename, lineno, date, account, document_filename, tags_links,
-                 kvlist):
+                 kvlist, _new_metadata=new_metadata, _Document=Document):
         """Process a document directive.
 
         Args:
@@ -736,14 +823,21 @@ class Builder(lexer.LexBuilder):
         Returns:
           A new Document object.
         """
-        meta = new_metadata(filename, lineno, kvlist)
+        meta = _new_metadata(filename, lineno, kvlist)
         if not path.isabs(document_filename):
-            document_filename = path.abspath(path.join(path.dirname(filename),
-                                                       document_filename))
+            # Resolve relative to the directory of the file being parsed. That
+            # absolute directory is computed only once per input file.
+            try:
+                directory = self.document_dirs[filename]
+            except KeyError:
+                directory = self.document_dirs[filename] = path.abspath(
+                    path.dirname(filename))
+            document_filename = path.normpath(path.join(directory, document_filename))
         tags, links = self._finalize_tags_links(tags_links.tags, tags_links.links)
-        return Document(meta, date, account, document_filename, tags, links)
+        return _Document(meta, date, account, document_filename, tags, links)
 
-    def custom(self, filename, lineno, date, dir_type, custom_values, kvlist):
+    def custom(self, filename, lineno, date, dir_type, custom_values, kvlist,
+               _new_metadata=new_metadata, _Custom=Custom):
         """Process a custom directive.
 
         Args:
@@ -756,8 +850,8 @@ class Builder(lexer.LexBuilder):
         Returns:
           A new Custom object.
         """
-        meta = new_metadata(filename, lineno, kvlist)
-        return Custom(meta, date, dir_type, custom_values)
+        meta = _new_metadata(filename, lineno, kvlist)
+        return _Custom(meta, date, dir_type, custom_values)
 
     def custom_value(self, filename, lineno, value, dtype=None):
         """Create a custom value object, along with its type.
@@ -802,7 +896,9 @@ class Builder(lexer.LexBuilder):
         Returns:
           A new Posting object, with no parent entry.
         """
-        meta = new_metadata(filename, lineno)
+        # Note: This is an inlined version of new_metadata(), to avoid a function
+        # call for every posting.
+        meta = {'filename': filename, 'lineno': lineno}
 
         # Prices may not be negative.
         if price and isinstance(price.number, Decimal) and price.number < ZERO:
@@ -853,7 +949,8 @@ class Builder(lexer.LexBuilder):
                             "Cost and price currencies must match: {} != {}".format(
                                 cost.currency, price.currency), None))
 
-        return Posting(account, units, cost, price, chr(flag) if flag else None, meta)
+        return Posting(account, units, cost, price,
+                       FLAG_CHARS[flag] if flag else None, meta)
 
     def tag_link_new(self, filename, lineno):
         """Create a new TagsLinks instance.
@@ -872,7 +969,8 @@ class Builder(lexer.LexBuilder):
         Returns:
           An updated TagsLinks instance.
         """
-        tags_links.tags.add(tag)
+        # Intern tags and links; they are typically repeated across many entries.
+        tags_links.tags.add(sys.intern(tag))
         return tags_links
 
     def tag_link_LINK(self, filename, lineno, tags_links, link):
@@ -884,7 +982,7 @@ class Builder(lexer.LexBuilder):
         Returns:
           An updated TagsLinks instance.
         """
-        tags_links.links.add(link)
+        tags_links.links.add(sys.intern(link))
         return tags_links
 
     def _unpack_txn_strings(self, txn_strings, meta):
@@ -923,8 +1021,24 @@ class Builder(lexer.LexBuilder):
         """
         if self.tags:
             tags.update(self.tags)
-        return (frozenset(tags) if tags else EMPTY_SET,
-                frozenset(links) if links else EMPTY_SET)
+        elif not tags and not links:
+            # Most entries have neither tags nor links.
+            return EMPTY_SET, EMPTY_SET
+
+        # Share a single frozenset instance between entries with the same set of
+        # tags or links. These are repeated liberally.
+        frozensets = self.frozensets
+        if tags:
+            tags = frozenset(tags)
+            tags = frozensets.setdefault(tags, tags)
+        else:
+            tags = EMPTY_SET
+        if links:
+            links = frozenset(links)
+            links = frozensets.setdefault(links, links)
+        else:
+            links = EMPTY_SET
+        return tags, links
 
     def transaction(self, filename, lineno, date, flag, txn_strings, tags_links,
                     posting_or_kv_list):
@@ -950,7 +1064,7 @@ class Builder(lexer.LexBuilder):
         Returns:
           A new Transaction object.
         """
-        meta = new_metadata(filename, lineno)
+        meta = {'filename': filename, 'lineno': lineno}
 
         # Separate postings and key-values.
         explicit_meta = {}
@@ -958,11 +1072,15 @@ class Builder(lexer.LexBuilder):
         tags, links = tags_links.tags, tags_links.links
         if posting_or_kv_list:
             last_posting = None
+            append_posting = postings.append
             for posting_or_kv in posting_or_kv_list:
-                if isinstance(posting_or_kv, Posting):
-                    postings.append(posting_or_kv)
+                # Note: The builder creates these objects itself, so an exact
+                # type comparison is sufficient and cheaper than isinstance().
+                item_type = type(posting_or_kv)
+                if item_type is Posting:
+                    append_posting(posting_or_kv)
                     last_posting = posting_or_kv
-                elif isinstance(posting_or_kv, TagsLinks):
+                elif item_type is TagsLinks:
                     if postings:
                         self.errors.append(ParserError(
                             meta,
@@ -972,25 +1090,27 @@ class Builder(lexer.LexBuilder):
                         tags.update(posting_or_kv.tags)
                         links.update(posting_or_kv.links)
                 else:
+                    key, value = posting_or_kv
                     if last_posting is None:
-                        value = explicit_meta.setdefault(posting_or_kv.key,
-                                                         posting_or_kv.value)
-                        if value is not posting_or_kv.value:
+                        if key in explicit_meta:
                             self.errors.append(ParserError(
                                 meta, "Duplicate metadata field on entry: {}".format(
                                     posting_or_kv), None))
+                        else:
+                            explicit_meta[key] = value
                     else:
                         if last_posting.meta is None:
-                            last_posting = last_posting._replace(meta={})
-                            postings.pop(-1)
-                            postings.append(last_posting)
+                            # Note: Postings created by this builder always have
+                            # metadata; this only handles foreign ones.
+                            postings[-1] = last_posting = last_posting._replace(meta={})
 
-                        value = last_posting.meta.setdefault(posting_or_kv.key,
-                                                             posting_or_kv.value)
-                        if value is not posting_or_kv.value:
+                        posting_meta = last_posting.meta
+                        if key in posting_meta:
                             self.errors.append(ParserError(
                                 meta, "Duplicate posting metadata field: {}".format(
                                     posting_or_kv), None))
+                        else:
+                            posting_meta[key] = value
 
         # Freeze the tags & links or set to default empty values.
         tags, links = self._finalize_tags_links(tags, links)
@@ -1027,5 +1147,29 @@ class Builder(lexer.LexBuilder):
             postings = []
 
         # Create the transaction.
-        return Transaction(meta, date, chr(flag),
+        return Transaction(meta, date, FLAG_CHARS[flag],
                            payee, narration, tags, links, postings)
+
+
+def _get_option_setter(default_value):
+    """Select the Builder method which sets an option of a particular type.
+
+    Args:
+      default_value: The default value of an option.
+    Returns:
+      An unbound method of Builder.
+    """
+    if isinstance(default_value, list):
+        return Builder._set_list_option
+    elif isinstance(default_value, dict):
+        return Builder._set_dict_option
+    elif isinstance(default_value, bool):
+        return Builder._set_bool_option
+    else:
+        return Builder._set_scalar_option
+
+
+# A mapping of option name to the Builder method used to set its value. The type
+# of an option's value never changes, so this is decided once from its default.
+OPTION_SETTERS = {key: _get_option_setter(default_value)
+                  for key, default_value in options.OPTIONS_DEFAULTS.items()}
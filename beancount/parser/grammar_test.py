@@ -5,11 +5,13 @@ __copyright__ = "Copyright (C) 2015-2016  Martin Blais"
 __license__ = "GNU GPLv2"
 
 import datetime
+import os
 import unittest
 import inspect
 import textwrap
 import re
 from decimal import Decimal
+from os import path
 from unittest import mock
 
 from beancount.core.number import D
@@ -25,6 +27,7 @@ from beancount.core import data
 from beancount.core import amount
 from beancount.utils import test_utils
 from beancount.parser import cmptest
+from beancount.parser import options
 
 
 def check_list(test, objlist, explist):
@@ -765,6 +768,18 @@ class TestToleranceOptions(unittest.TestCase):
                           "JPY": D("0.5")},
                          options_map['inferred_tolerance_default'])
 
+    def test_dict_option_invalid_value(self):
+        # Bypass the converter, which otherwise only ever produces valid pairs.
+        descriptor = options.OPTIONS['inferred_tolerance_default']
+        with mock.patch.dict(options.OPTIONS, {
+                'inferred_tolerance_default': descriptor._replace(converter=None)}):
+            _, errors, options_map = parser.parse_string("""
+              option "inferred_tolerance_default" "USD:0.05"
+            """, dedent=True)
+        self.assertEqual(1, len(errors))
+        self.assertRegex(errors[0].message, "Error for option")
+        self.assertEqual({}, options_map['inferred_tolerance_default'])
+
 
 class TestDeprecatedOptions(unittest.TestCase):
 
@@ -1012,6 +1027,22 @@ class TestTransactions(unittest.TestCase):
         self.assertEqual({"basetag"}, entries[0].tags)
         self.assertEqual({"baselink"}, entries[0].links)
 
+    @parser.parse_doc()
+    def test_tags_links_shared(self, entries, errors, _):
+        """
+          2014-04-20 * "First" #trip #food ^shared
+            Expenses:Restaurant         100 USD
+            Assets:US:Cash             -100 USD
+
+          2014-04-21 * "Second" #food #trip ^shared
+            Expenses:Restaurant         100 USD
+            Assets:US:Cash             -100 USD
+        """
+        check_list(self, entries, [data.Transaction, data.Transaction])
+        self.assertEqual({"trip", "food"}, entries[0].tags)
+        self.assertIs(entries[0].tags, entries[1].tags)
+        self.assertIs(entries[0].links, entries[1].links)
+
 
 class TestParseLots(unittest.TestCase):
 
@@ -1511,6 +1542,25 @@ class TestMetaData(unittest.TestCase):
         self.assertTrue(all(re.search('Duplicate.*metadata field', error.message)
                             for error in errors))
 
+    @parser.parse_doc(expect_errors=True)
+    def test_metadata_transaction__repeated_same_value(self, entries, errors, _):
+        """
+          2013-05-18 * ""
+            test:
+            test:
+            Assets:Investments   100 USD
+              test: TRUE
+              test: TRUE
+            Income:Investments  -100 USD
+        """
+        self.assertEqual(1, len(entries))
+        self.assertEqual(None, entries[0].meta['test'])
+        self.assertEqual({'test': True},
+                         self.strip_meta(entries[0].postings[0].meta))
+        self.assertEqual(2, len(errors))
+        self.assertTrue(all(re.search('Duplicate.*metadata field', error.message)
+                            for error in errors))
+
     @parser.parse_doc()
     def test_metadata_empty(self, entries, errors, _):
         """
@@ -2547,6 +2597,16 @@ class TestDocument(unittest.TestCase):
         check_list(self, entries, [data.Document])
         self.assertEqual({'something'}, entries[0].links)
 
+    def test_document_relative(self):
+        entries, _, __ = parser.parse_string(textwrap.dedent("""
+          2013-05-18 document Assets:US:BestBank:Checking "statement.pdf"
+          2013-05-19 document Assets:US:BestBank:Checking "../other/statement.pdf"
+        """), report_filename=path.join(os.sep, 'ledger', 'main.beancount'))
+        check_list(self, entries, [data.Document, data.Document])
+        self.assertEqual([path.abspath(path.join(os.sep, 'ledger', 'statement.pdf')),
+                          path.abspath(path.join(os.sep, 'other', 'statement.pdf'))],
+                         [entry.filename for entry in entries])
+
 
 class TestMethodsSignature(unittest.TestCase):
 
@@ -17,6 +17,8 @@ LexerError = collections.namedtuple('LexerError', 'source message entry')
 class LexBuilder:
     """A builder used only for building lexer objects."""
 
+    __slots__ = ('errors',)
+
     def __init__(self):
         # Errors that occurred during lexing and parsing.
         self.errors = []